@@ -0,0 +1,30 @@
+# agent/adapters.py
+from functools import lru_cache
+
+import dspy
+
+@lru_cache(maxsize=None)
+def _static_first(signature, static_fields: tuple):
+    """Copy of the signature with the static input fields moved to the front (cached per signature)."""
+    for name in reversed(static_fields):
+        if name in signature.input_fields:
+            field = signature.input_fields[name]
+            signature = signature.delete(name).prepend(name, field, field.annotation)
+    return signature
+
+class StaticPrefixAdapter(dspy.ChatAdapter):
+    """
+    ChatAdapter that formats the static input fields (e.g. the DB schema) ahead of the
+    per-question ones.
+
+    The system prompt and few-shot demos are already identical between calls, so with the
+    schema moved up the whole prompt up to the question is byte-identical too. Ollama
+    (llama.cpp) reuses the KV cache for a matching prompt prefix, so repeated SQL generation
+    calls -- including the repair loop -- only prefill the question/context tail.
+    """
+    def __init__(self, static_fields=("schema_context",), **kwargs):
+        super().__init__(**kwargs)
+        self.static_fields = tuple(static_fields)
+
+    def format(self, signature, demos, inputs):
+        return super().format(_static_first(signature, self.static_fields), demos, inputs)
@@ -1,18 +1,56 @@
+import re
+import json
 import dspy
-from typing import List, Dict, Any, TypedDict, Union
-from langgraph.graph import StateGraph, END
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, TypedDict, Union
 from rich.console import Console
 
-from agent.tools.sqlite_tool import NorthwindDB
-from agent.rag.retrieval import LocalRetriever
+# LangGraph, the retriever (numpy/numba) and the DB tool are imported lazily where used:
+# scripts that only need SimpleSQLModule (train/eval) skip their import cost.
 from agent.dspy_signatures import (
     RouterSignature, 
     TextToSQL, 
     GenerateAnswer, 
 )
 from agent.rag.utils.debug_utils import tracker
+from agent.adapters import StaticPrefixAdapter
+from agent.lm_config import OLLAMA_NUM_PARALLEL
 
-console = Console()
+console = Console(highlight=False)  # node logs are markup-styled; skip the regex highlighter
+
+# Numeric extraction for strict int/float answers (compiled once, not per synthesis)
+_INT_RE = re.compile(r"[-+]?\d+")
+_FLOAT_RE = re.compile(r"[-+]?\d*\.\d+|\d+")
+
+# Router fast path: lexical cues that make the route obvious without an LLM call.
+# Doc cues: campaigns/periods defined in the calendar, KPIs defined in the KPI docs, and years
+# (date ranges come from the docs) -- any of these means the SQL needs retrieved context.
+_DOC_CUE_RE = re.compile(
+    r"\b(calendar|campaign|summer|winter|spring|autumn|kpi|aov|average order value|"
+    r"(gross )?margin|(19|20)\d{2})\b", re.IGNORECASE)
+_CALC_CUE_RE = re.compile(
+    r"\b(sum|count|avg|average|total|revenue|sales|how many|top|most|highest|lowest|quantity)\b",
+    re.IGNORECASE)
+_POLICY_CUE_RE = re.compile(r"\b(polic(y|ies)|return (window|period)|can i return|days)\b", re.IGNORECASE)
+# Asking for a definition/formula ("How is AOV calculated?") is answered from the docs alone
+_DEFINITION_ASK_RE = re.compile(
+    r"\bhow (is|are)\b[^?]*\b(calculated|computed|defined|measured)\b|\bformula\b|"
+    r"\bwhat (is|are) the definitions? of\b", re.IGNORECASE)
+# Definition phrasing of any kind rules out sql_only
+_DEFINITION_CUE_RE = re.compile(r"\b(what is|formula|definitions?|defined)\b", re.IGNORECASE)
+
+# Planner fast path: doc sections ("## Summer Beverages 2016") and their literal date ranges
+_DOC_HEADER_RE = re.compile(r"^(?:Content:\s*)?#+\s*(.+?)\s*$", re.MULTILINE)
+_DATE_RANGE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})\s*(?:to|-|through)\s*(\d{4}-\d{2}-\d{2})")
+_MARGIN_RULE = "Margin = (UnitPrice - UnitPrice*0.7) * Quantity"
+# KPI formula bullets inside a doc section ("- AOV = SUM(...) / COUNT(...)")
+_FORMULA_RE = re.compile(r"^-\s*(\S[^=\n]*=.+?)\s*$", re.MULTILINE)
+# Section header aliases: "Average Order Value (AOV)" -> "average order value", "aov"
+# (alphabetic abbreviations only -- "Calendar (2016)" must not match every 2016 question)
+_HEADER_ALIAS_RE = re.compile(r"\s*\(([a-z]+)\)\s*")
+# KPIs whose formula the SQL needs (gross margin is covered by _MARGIN_RULE)
+_KPI_MENTION_RE = re.compile(r"\b(aov|average order value)\b", re.IGNORECASE)
 
 # --- 0. Planner Signature (Local) ---
 class PlannerSignature(dspy.Signature):
@@ -39,6 +77,7 @@ class AgentState(TypedDict):
     format_hint: str
     
     # Analysis
+    rule_route: Optional[str]  # _route_heuristic result (None: ambiguous, the LLM routes)
     classification: str
     
     # Data Context
@@ -69,11 +108,72 @@ class SimpleSQLModule(dspy.Module):
     def forward(self, question, schema_context, context):
         return self.generate(question=question, schema_context=schema_context, context=context)
 
-# --- 3. Node Functions ---
+# Max SQL result rows passed to the Synthesizer
+MAX_RESULT_ROWS = 50
+
+# SQL keyword -> table name cited when a successful query touches it
+TABLE_CITATIONS = [
+    ("orders", "Orders"),
+    ("order_items", "Order Details"),
+    ("products", "Products"),
+    ("customers", "Customers"),
+]
+
+# --- 3. Shared Resources ---
+# The DB (and the schema it memoizes) is static for the life of the process, so build it once.
+
+def _get_db():
+    from agent.tools.sqlite_tool import get_db
+    return get_db()
+
+# Schema goes first in the SQL prompt so repeated calls share a cacheable prefix
+_SQL_ADAPTER = StaticPrefixAdapter(static_fields=("schema_context",))
+
+@lru_cache(maxsize=None)
+def _get_predictor(signature) -> dspy.Predict:
+    """One dspy.Predict per signature, reused across calls instead of rebuilt per node run."""
+    return dspy.Predict(signature)
+
+@lru_cache(maxsize=1)
+def _get_sql_generator() -> SimpleSQLModule:
+    # Try loading optimized module (once -- repair loops reuse the same instance)
+    generator = SimpleSQLModule()
+    try:
+        generator.load("agent/optimized_sql_module.json")
+    except:
+        pass
+    return generator
+
+# --- 4. Node Functions ---
+
+def _route_heuristic(question: str) -> Optional[str]:
+    """
+    Rule-based routing for questions with strong lexical signals; None means ambiguous (ask the LLM).
+    - rag_only: asks how a KPI is calculated/defined
+    - hybrid:   a doc reference (campaign, KPI, year) AND a calculation ("total ... during 'Summer Beverages 2016'")
+    - rag_only: a policy question with no doc reference
+    - sql_only: a calculation with no doc, policy or definition cue
+    """
+    if _DEFINITION_ASK_RE.search(question): return "rag_only"
+    
+    doc_cue = _DOC_CUE_RE.search(question)
+    calc_cue = _CALC_CUE_RE.search(question)
+    policy_cue = _POLICY_CUE_RE.search(question)
+    
+    if doc_cue and calc_cue: return "hybrid"
+    if policy_cue and not doc_cue: return "rag_only"
+    if calc_cue and not doc_cue and not policy_cue and not _DEFINITION_CUE_RE.search(question):
+        return "sql_only"
+    return None
 
 def router_node(state: AgentState):
     console.print(f"\n[bold cyan]🔀 Router[/bold cyan]")
-    predictor = dspy.Predict(RouterSignature)
+    final_cls = state["rule_route"] if "rule_route" in state else _route_heuristic(state["question"])
+    if final_cls:
+        console.print(f"  [dim]Classified as: {final_cls} (rules)[/dim]")
+        return {"classification": final_cls}
+    
+    predictor = _get_predictor(RouterSignature)
     result = predictor(question=state["question"])
     
     raw_cls = getattr(result, "classification", "rag_only").lower()
@@ -81,16 +181,21 @@ def router_node(state: AgentState):
     if "sql" in raw_cls: final_cls = "sql_only"
     if "hybrid" in raw_cls: final_cls = "hybrid"
     
-    console.print(f"  [dim]Classified as: {final_cls}[/dim]")
+    console.print(f"  [dim]Classified as: {final_cls} (LLM)[/dim]")
     return {"classification": final_cls}
 
 def retrieval_node(state: AgentState):
+    from agent.rag.retrieval import get_retriever
+    from agent.rag.compress import compress
+    
     console.print(f"\n[bold cyan]📚 Retriever[/bold cyan]")
-    retriever = LocalRetriever()
+    retriever = get_retriever()
     # Increased k to 4 to ensure calendar + policies both fit
     chunks = retriever.search(state["question"], k=4)
     
     context_str = "\n\n".join([f"Source: {c['id']}\nContent: {c['text']}" for c in chunks])
+    # Cap what flows into Planner/Synthesizer prompts; full chunks stay in doc_chunks for citations
+    context_str = compress(context_str, max_tokens=512)
     citations = [c['id'] for c in chunks]
     
     console.print(f"  [green]Found {len(chunks)} chunks[/green]")
@@ -100,13 +205,80 @@ def retrieval_node(state: AgentState):
         "citations": citations # partial citations
     }
 
+def route_and_retrieve_node(state: AgentState):
+    """
+    Router + speculative retrieval. Retrieval only depends on the question, so it runs in a
+    worker thread while the router's LLM call is in flight; its output is dropped for sql_only.
+
+    When the rules can't route, the LLM has to, and Ollama has a spare slot (OLLAMA_NUM_PARALLEL > 1),
+    a sql_only draft is generated alongside it: sql_only has no planner context, so sql_gen later
+    issues the exact same call and is served from the LM cache instead of paying a second round trip.
+    With a single slot the draft would queue ahead of the planner/synthesizer, so it is skipped.
+    """
+    state = {**state, "rule_route": _route_heuristic(state["question"])}
+    pool = ThreadPoolExecutor(max_workers=2)
+    retrieval = pool.submit(retrieval_node, state)
+    sql_draft = None
+    if state["rule_route"] is None and OLLAMA_NUM_PARALLEL > 1:
+        sql_draft = pool.submit(_generate_sql, state["question"], "")
+    try:
+        update = router_node(state)
+        if update["classification"] != "sql_only":
+            update.update(retrieval.result())
+        elif sql_draft is not None:
+            sql_draft.exception()  # just wait; a failed draft is retried by sql_gen itself
+    finally:
+        # Don't block on work whose result this route discards
+        pool.shutdown(wait=False)
+    return update
+
+def _names_section(header: str, lower_q: str) -> bool:
+    """True if the question names the doc section, by its full title or its (ABBREVIATION)."""
+    header = header.lower()
+    aliases = {header, _HEADER_ALIAS_RE.sub(" ", header).strip(), *_HEADER_ALIAS_RE.findall(header)}
+    return any(re.search(rf"\b{re.escape(alias)}\b", lower_q) for alias in aliases if alias)
+
+def _extract_constraints(docs: str, question: str) -> Optional[str]:
+    """
+    Rule-based planner: if the question names a doc section (e.g. a campaign) whose body holds
+    a literal date range, emit the BETWEEN filter directly, plus the formula lines of any KPI
+    section it names. None means fall back to the LLM -- including when a KPI is mentioned
+    but its formula isn't in the retrieved docs.
+    """
+    headers = list(_DOC_HEADER_RE.finditer(docs))
+    lower_q = question.lower()
+    date_filter, formulas = None, []
+    
+    for i, header in enumerate(headers):
+        if not _names_section(header.group(1), lower_q): continue
+        section_end = headers[i + 1].start() if i + 1 < len(headers) else len(docs)
+        dates = _DATE_RANGE_RE.search(docs, header.end(), section_end)
+        if dates and date_filter is None:
+            date_filter = f"OrderDate BETWEEN '{dates.group(1)}' AND '{dates.group(2)}'"
+        # The doc's gross margin formula needs CostOfGoods, which the DB lacks -> _MARGIN_RULE below
+        if "gross margin" not in header.group(1).lower():
+            formulas += _FORMULA_RE.findall(docs, header.end(), section_end)
+    
+    if date_filter is None: return None
+    if _KPI_MENTION_RE.search(question) and not formulas: return None
+    
+    constraints = [date_filter, *dict.fromkeys(formulas)]
+    if "gross margin" in lower_q:
+        constraints.append(_MARGIN_RULE)
+    return "; ".join(constraints)
+
 def planner_node(state: AgentState):
     """
     CRITICAL STEP: Translates "Summer 1997" -> "1997-06-01..."
     """
     console.print(f"\n[bold cyan]🗺️  Planner[/bold cyan]")
     
-    planner = dspy.Predict(PlannerSignature)
+    constraints = _extract_constraints(state["doc_context_str"], state["question"])
+    if constraints:
+        console.print(f"  [bold yellow]Constraints (from docs): {constraints}[/bold yellow]")
+        return {"extracted_constraints": constraints}
+    
+    planner = _get_predictor(PlannerSignature)
     result = planner(
         context_docs=state["doc_context_str"], 
         question=state["question"]
@@ -120,18 +292,20 @@ def planner_node(state: AgentState):
     
     return {"extracted_constraints": constraints}
 
+def _generate_sql(question: str, context: str) -> dspy.Prediction:
+    with dspy.context(adapter=_SQL_ADAPTER):
+        return _get_sql_generator()(
+            question=question,
+            schema_context=_get_db().get_schema(),
+            context=context
+        )
+
 def sql_generation_node(state: AgentState):
-    console.print(f"\n[bold cyan]⚙️  SQL Generator[/bold cyan]")
+    from agent.tools.sqlite_tool import strip_sql_fences
     
-    db = NorthwindDB()
-    schema = db.get_schema()
+    console.print(f"\n[bold cyan]⚙️  SQL Generator[/bold cyan]")
     
-    # Try loading optimized module
-    generator = SimpleSQLModule()
-    try:
-        generator.load("agent/optimized_sql_module.json")
-    except:
-        pass
+    schema = _get_db().get_schema()
 
     # Logic: Combine Planner Constraints into the prompt
     planner_context = state.get("extracted_constraints", "")
@@ -143,15 +317,11 @@ def sql_generation_node(state: AgentState):
         planner_context += f"\n\nIMPORTANT: Previous query failed with error: {state['error']}. Fix the syntax."
         console.print(f"  [red]Repairing SQL (Attempt {retries}/2)[/red]")
 
-    pred = generator(
-        question=state["question"],
-        schema_context=schema,
-        context=planner_context
-    )
+    pred = _generate_sql(state["question"], planner_context)
     
     sql = getattr(pred, "sql_query", "")
     # Clean markdown
-    sql = sql.replace("```sql", "").replace("```", "").strip()
+    sql = strip_sql_fences(sql)
     
     console.print(f"  [dim]{sql[:80]}...[/dim]")
     return {
@@ -162,7 +332,7 @@ def sql_generation_node(state: AgentState):
 
 def sql_execution_node(state: AgentState):
     console.print(f"\n[bold cyan]▶️  Executor[/bold cyan]")
-    db = NorthwindDB()
+    db = _get_db()
     
     if not state.get("sql_query"):
         return {"sql_result": "No SQL generated", "error": "No SQL"}
@@ -176,22 +346,27 @@ def sql_execution_node(state: AgentState):
     console.print(f"  [green]Success: {len(result)} rows[/green]")
     
     # Add Tables to citations if successful
-    new_citations = state.get("citations", [])
     lower_sql = state["sql_query"].lower()
-    if "orders" in lower_sql: new_citations.append("Orders")
-    if "order_items" in lower_sql: new_citations.append("Order Details")
-    if "products" in lower_sql: new_citations.append("Products")
-    if "customers" in lower_sql: new_citations.append("Customers")
+    table_cites = [cite for keyword, cite in TABLE_CITATIONS if keyword in lower_sql]
     
-    return {"sql_result": result, "error": None, "citations": list(set(new_citations))}
+    # Order-preserving dedup (doc chunks first, then tables); builds a new list instead of mutating state
+    new_citations = list(dict.fromkeys([*state.get("citations", []), *table_cites]))
+    return {"sql_result": result, "error": None, "citations": new_citations}
 
 def synthesis_node(state: AgentState):
     console.print(f"\n[bold cyan]🎯 Synthesizer[/bold cyan]")
     
     # We use the Base Signature but IGNORE the model's citation output
-    synthesizer = dspy.Predict(GenerateAnswer)
+    synthesizer = _get_predictor(GenerateAnswer)
     
-    sql_res = str(state.get("sql_result", ""))[:2000] # Truncate large results
+    # Cap rows before serializing (never cut a row in half); errors/messages are plain strings
+    sql_res = state.get("sql_result", "")
+    if isinstance(sql_res, list):
+        if len(sql_res) > MAX_RESULT_ROWS:
+            sql_res = sql_res[:MAX_RESULT_ROWS] + [{"_truncated": f"{len(sql_res) - MAX_RESULT_ROWS} more rows"}]
+        sql_res = json.dumps(sql_res, default=str)
+    else:
+        sql_res = str(sql_res)[:2000]
     
     pred = synthesizer(
         question=state["question"],
@@ -210,14 +385,12 @@ def synthesis_node(state: AgentState):
     try:
         if fmt == "int":
             # Extract first number found
-            import re
-            nums = re.findall(r"[-+]?\d+", str(final_ans))
-            final_ans = int(nums[0]) if nums else 0
+            match = _INT_RE.search(str(final_ans))
+            final_ans = int(match.group()) if match else 0
         elif fmt == "float":
-            import re
             # Find float pattern
-            nums = re.findall(r"[-+]?\d*\.\d+|\d+", str(final_ans))
-            final_ans = float(nums[0]) if nums else 0.0
+            match = _FLOAT_RE.search(str(final_ans))
+            final_ans = float(match.group()) if match else 0.0
     except:
         console.print(f"  [yellow]⚠ Type cast failed for {fmt}, keeping raw string[/yellow]")
 
@@ -232,7 +405,7 @@ def synthesis_node(state: AgentState):
         "confidence": 1.0 if not state.get("error") else 0.0
     }
 
-# --- 4. Edges ---
+# --- 5. Edges ---
 
 def decide_route(state: AgentState):
     return state["classification"]
@@ -242,13 +415,16 @@ def check_sql_health(state: AgentState):
         return "repair"
     return "synthesize"
 
-# --- 5. Build ---
+# --- 6. Build ---
 
+@lru_cache(maxsize=1)
 def build_graph():
+    """Compiled graph, built once per process (it is stateless, so invocations can share it)."""
+    from langgraph.graph import StateGraph, END
+    
     workflow = StateGraph(AgentState)
     
-    workflow.add_node("router", router_node)
-    workflow.add_node("retriever", retrieval_node)
+    workflow.add_node("router", route_and_retrieve_node)
     workflow.add_node("planner", planner_node)
     workflow.add_node("sql_gen", sql_generation_node)
     workflow.add_node("executor", sql_execution_node)
@@ -259,13 +435,7 @@ def build_graph():
     workflow.add_conditional_edges(
         "router",
         decide_route,
-        {"rag_only": "retriever", "sql_only": "sql_gen", "hybrid": "retriever"}
-    )
-    
-    workflow.add_conditional_edges(
-        "retriever",
-        lambda x: "planner" if x["classification"] == "hybrid" else "synthesizer",
-        {"planner": "planner", "synthesizer": "synthesizer"}
+        {"rag_only": "synthesizer", "sql_only": "sql_gen", "hybrid": "planner"}
     )
     
     workflow.add_edge("planner", "sql_gen")
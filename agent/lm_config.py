@@ -0,0 +1,62 @@
+# agent/lm_config.py
+import os
+from functools import lru_cache
+
+import dspy
+
+MODEL_NAME = "ollama_chat/phi3.5:3.8b-mini-instruct-q3_K_M"
+API_BASE = "http://localhost:11434"
+
+# Ollama unloads an idle model after 5 minutes by default; -1 keeps it resident, so a pause
+# between questions or optimizer rounds doesn't pay for reloading the weights
+OLLAMA_KEEP_ALIVE = -1
+
+# Requests the Ollama server runs concurrently (its own OLLAMA_NUM_PARALLEL setting; 1 unless
+# exported). Speculative LM calls only pay off with a free slot -- with one, they queue ahead of real work.
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "1"))
+
+# Persistent LLM response cache. Calls are deterministic (temperature=0.0), so identical
+# requests -- re-runs over the same batch, repeated router/planner prompts -- are served from disk.
+LLM_CACHE_DIR = os.path.expanduser("~/.cache/retail-copilot/llm")
+
+# LMs already warmed in this process (by id), so repeated setup doesn't ping Ollama again
+_WARMED = set()
+
+@lru_cache(maxsize=None)
+def get_lm(max_tokens: int = 4096, **kwargs) -> dspy.LM:
+    """One dspy.LM per distinct config (e.g. max_tokens, num_ctx), shared by every caller."""
+    return dspy.LM(
+        model=MODEL_NAME,
+        api_base=API_BASE,
+        max_tokens=max_tokens,
+        temperature=0.0,
+        cache=True,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        **kwargs
+    )
+
+@lru_cache(maxsize=None)
+def init_dspy(max_tokens: int = 4096, **kwargs) -> dspy.LM:
+    """
+    Process-wide DSPy setup for the entrypoints: disk cache + the shared LM as default.
+    Repeated calls with the same config are no-ops that return the same LM.
+    """
+    dspy.configure_cache(enable_disk_cache=True, enable_memory_cache=True, disk_cache_dir=LLM_CACHE_DIR)
+    lm = get_lm(max_tokens=max_tokens, **kwargs)
+    dspy.configure(lm=lm)
+    return lm
+
+def warm_up(lm: dspy.LM) -> bool:
+    """
+    Send a 1-token request so Ollama loads the model now, during setup, rather than on the
+    first real question. Bypasses the response cache (a cached ping would not reach Ollama).
+    Returns False if the server could not be reached.
+    """
+    if id(lm) in _WARMED:
+        return True
+    try:
+        lm("ping", max_tokens=1, cache=False)
+    except Exception:
+        return False
+    _WARMED.add(id(lm))
+    return True
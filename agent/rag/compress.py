@@ -0,0 +1,105 @@
+# agent/rag/compress.py
+import re
+import numpy as np
+from typing import List
+
+from agent.rag.retrieval import tokenize
+
+# Sentence boundaries inside a line; every line break is a boundary too (docs are bullet lists)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+# Lines that carry structure/citations rather than content -- always kept
+_STRUCTURE_RE = re.compile(r"^(Source:|Content:|#)")
+
+def _split_units(text: str) -> List[str]:
+    units = []
+    for line in text.splitlines():
+        if not line.strip(): continue
+        if _STRUCTURE_RE.match(line):
+            units.append(line)
+        else:
+            units.extend(s for s in _SENTENCE_RE.split(line) if s.strip())
+    return units
+
+def _truncate(unit: str, limit: int) -> str:
+    """Leading words of unit holding at most `limit` tokens."""
+    words, used = [], 0
+    for word in unit.split():
+        used += len(tokenize(word))
+        if used > limit: break
+        words.append(word)
+    return " ".join(words)
+
+def _textrank(token_lists: List[List[str]], damping: float = 0.85, iters: int = 50) -> np.ndarray:
+    """PageRank over the TF-IDF cosine-similarity graph of the sentences."""
+    vocab = {}
+    for tokens in token_lists:
+        for tok in tokens:
+            vocab.setdefault(tok, len(vocab))
+
+    n = len(token_lists)
+    tf = np.zeros((n, max(len(vocab), 1)))
+    for row, tokens in enumerate(token_lists):
+        for tok in tokens:
+            tf[row, vocab[tok]] += 1
+
+    df = np.count_nonzero(tf, axis=0)
+    tfidf = tf * (np.log((1 + n) / (1 + df)) + 1)
+    norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+    tfidf = np.divide(tfidf, norms, out=np.zeros_like(tfidf), where=norms > 0)
+
+    sim = tfidf @ tfidf.T
+    np.fill_diagonal(sim, 0.0)
+    out_weight = sim.sum(axis=1, keepdims=True)
+    # Sentences with no similar neighbours spread their rank uniformly
+    transition = np.divide(sim, out_weight, out=np.full_like(sim, 1.0 / n), where=out_weight > 0)
+
+    rank = np.full(n, 1.0 / n)
+    for _ in range(iters):
+        rank = (1 - damping) / n + damping * (transition.T @ rank)
+    return rank
+
+def compress(text: str, max_tokens: int = 512) -> str:
+    """
+    Extractive compression of retrieved context down to ~max_tokens.
+    Sentences are ranked by TextRank (TF-IDF similarity graph) weighted by their position
+    inside each chunk, picked greedily within the budget (the first one that doesn't fit is
+    truncated to what's left), and returned in original order. Source/header lines are kept
+    first but may use at most a quarter of the budget.
+    Text already within budget is returned unchanged.
+    """
+    if len(tokenize(text)) <= max_tokens:
+        return text
+
+    units = _split_units(text)
+    token_lists = [tokenize(u) for u in units]
+
+    # Earlier sentences of a chunk (right after its header) tend to be the definitions/dates
+    positions, pos = [], 0
+    for u in units:
+        pos = 0 if _STRUCTURE_RE.match(u) else pos + 1
+        positions.append(pos)
+    scores = _textrank(token_lists) / np.sqrt(np.array(positions) + 1)
+
+    # Structure lines first, in order, but capped so they can't crowd out the content
+    keep, budget = {}, max_tokens
+    structure_budget = max_tokens // 4
+    for i, u in enumerate(units):
+        if _STRUCTURE_RE.match(u) and len(token_lists[i]) <= structure_budget:
+            keep[i] = u
+            structure_budget -= len(token_lists[i])
+            budget -= len(token_lists[i])
+    # Then content by rank; a unit that doesn't fit is cut to the remaining budget, so the
+    # top-ranked unit always makes it in (even a single paragraph longer than max_tokens)
+    for i in np.argsort(-scores, kind="stable"):
+        if budget <= 0: break
+        if i in keep or _STRUCTURE_RE.match(units[i]): continue
+        if len(token_lists[i]) <= budget:
+            keep[i] = units[i]
+            budget -= len(token_lists[i])
+        else:
+            truncated = _truncate(units[i], budget)
+            if truncated:
+                keep[i] = truncated
+                budget -= len(tokenize(truncated))
+
+    return "\n".join(keep[i] for i in sorted(keep))
@@ -1,18 +1,96 @@
 # agent/rag/retrieval.py
 import os
+import re
 import glob
-from typing import List, Dict
-from rank_bm25 import BM25Okapi
+import threading
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Tuple
+
+# BM25 (Okapi) parameters -- same defaults as rank_bm25.BM25Okapi
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+try:
+    # Optional: JIT-compiles the BM25 kernel to native code when numba is installed
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Runs of alphanumeric chars (\w minus "_") -- same tokens as the old per-char isalnum() loop, scanned in C
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+# Markdown "## " section headers at the start of a line -- chunk boundaries
+_HEADER_RE = re.compile(r"(?m)^## ")
+
+def tokenize(text: str) -> List[str]:
+    """Simple tokenization: lowercase and alphanumeric only"""
+    return _TOKEN_RE.findall(text.lower())
+
+def _bm25_kernel(data, indices, indptr, idf, norm, query_weights, k1):
+    """
+    BM25 over a CSR term-frequency matrix: one pass over each chunk's non-zero terms.
+    query_weights[col] is how many times that term occurs in the query (0 = not queried).
+    """
+    num_docs = len(indptr) - 1
+    scores = np.zeros(num_docs)
+    for d in range(num_docs):
+        total = 0.0
+        for j in range(indptr[d], indptr[d + 1]):
+            col = indices[j]
+            if query_weights[col] > 0:
+                tf = data[j]
+                total += query_weights[col] * idf[col] * tf * (k1 + 1) / (tf + norm[d])
+        scores[d] = total
+    return scores
+
+# Serial on purpose: search() runs on the router's worker thread, and numba's parallel
+# (workqueue) threading layer launched off the main thread hangs interpreter shutdown.
+if njit is not None:
+    _bm25_kernel = njit(cache=True)(_bm25_kernel)
+
+# Process-wide cache of built retrievers, keyed by docs_dir.
+# Each entry remembers the docs fingerprint it was built from so edits to docs/ rebuild the index.
+_RETRIEVER_CACHE: Dict[str, Tuple[Tuple, "LocalRetriever"]] = {}
+# Serializes builds, so parallel workers asking at once share one index instead of each building one
+_RETRIEVER_LOCK = threading.Lock()
+
+def _docs_fingerprint(docs_dir: str) -> Tuple:
+    """(path, mtime, size) for every markdown file -- cheap stat calls, no reads."""
+    md_files = sorted(glob.glob(os.path.join(docs_dir, "*.md")))
+    return tuple((f, os.path.getmtime(f), os.path.getsize(f)) for f in md_files)
+
+def get_retriever(docs_dir: str = "docs") -> "LocalRetriever":
+    """
+    Returns a shared LocalRetriever for docs_dir, building the BM25 index only
+    the first time (or again if any doc file changed since).
+    """
+    fingerprint = _docs_fingerprint(docs_dir)
+    with _RETRIEVER_LOCK:
+        cached = _RETRIEVER_CACHE.get(docs_dir)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+        retriever = LocalRetriever(docs_dir)
+        _RETRIEVER_CACHE[docs_dir] = (fingerprint, retriever)
+        return retriever
 
 class LocalRetriever:
     def __init__(self, docs_dir: str = "docs"):
         self.docs_dir = docs_dir
         self.chunks = []
-        self.bm25 = None
+        # BM25 statistics, precomputed once in _build_bm25()
+        self._vocab: Dict[str, int] = {}
+        self._tf_data = self._tf_indices = self._tf_indptr = self._tf_rows = None
+        self._idf = None
+        self._norm = None
         self._build_index()
 
     def _build_index(self):
             md_files = glob.glob(os.path.join(self.docs_dir, "*.md"))
+            # Parallel to self.chunks; only needed to build the index, so it stays local
+            tokenized_corpus: List[List[str]] = []
             print(f"  > [Retriever] Found files: {[os.path.basename(f) for f in md_files]}") # DEBUG PRINT
             
             for fpath in md_files:
@@ -22,49 +100,92 @@ class LocalRetriever:
                 
                 # IMPROVED CHUNKING: Split by "## " headers to keep sections together
                 # This ensures "Beverages" and "14 days" stay in the same chunk
-                raw_chunks = content.split("\n## ")
+                raw_chunks = _HEADER_RE.split(content)
                 
                 for i, text in enumerate(raw_chunks):
                     if not text.strip(): continue
                     
-                    # Add "## " back if it was removed by split
-                    full_text = text if text.startswith("#") else "## " + text
+                    # Everything after the first piece lost its "## " to the split; the first
+                    # piece is the preamble before any section (e.g. the "# Title" line)
+                    full_text = text if i == 0 else "## " + text
                     
                     chunk_id = f"{fname.replace('.md', '')}::chunk{i}"
                     self.chunks.append({
                         "id": chunk_id,
                         "text": full_text,
                         "source": fname,
-                        # Simple tokenization: lowercase and alphanumeric only
-                        "tokens": "".join([c if c.isalnum() else " " for c in full_text.lower()]).split()
                     })
+                    tokenized_corpus.append(tokenize(full_text))
 
-            tokenized_corpus = [c["tokens"] for c in self.chunks]
-            self.bm25 = BM25Okapi(tokenized_corpus)
+            if tokenized_corpus:
+                self._build_bm25(tokenized_corpus)
             print(f"  > [Retriever] Indexed {len(self.chunks)} chunks.")
 
+    def _build_bm25(self, tokenized_corpus: List[List[str]]):
+        """
+        Precomputes a CSR term-frequency matrix (data/indices/indptr), the IDF vector and the
+        per-chunk length normalisation, so scoring a query never touches the tokens again.
+        """
+        data, indices, indptr = [], [], [0]
+        for tokens in tokenized_corpus:
+            for tok, count in Counter(tokens).items():
+                indices.append(self._vocab.setdefault(tok, len(self._vocab)))
+                data.append(count)
+            indptr.append(len(indices))
+
+        self._tf_data = np.asarray(data, dtype=np.float64)
+        self._tf_indices = np.asarray(indices, dtype=np.int32)
+        self._tf_indptr = np.asarray(indptr, dtype=np.int32)
+        # Row of every non-zero, for the NumPy fallback scorer
+        self._tf_rows = np.repeat(np.arange(len(tokenized_corpus)), np.diff(self._tf_indptr))
+
+        # Okapi IDF; negative values (terms in most chunks) are floored to epsilon * mean idf
+        num_docs = len(tokenized_corpus)
+        doc_freq = np.bincount(self._tf_indices, minlength=len(self._vocab))
+        idf = np.log(num_docs - doc_freq + 0.5) - np.log(doc_freq + 0.5)
+        idf[idf < 0] = BM25_EPSILON * idf.mean()
+
+        doc_lens = np.bincount(self._tf_rows, weights=self._tf_data, minlength=num_docs)
+        self._idf = idf
+        self._norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lens / doc_lens.mean())
+
+    def _score(self, query_tokens: List[str]) -> np.ndarray:
+        # Repeated query tokens count once per occurrence, unknown tokens score 0
+        cols = [self._vocab[t] for t in query_tokens if t in self._vocab]
+        if not cols:
+            return np.zeros(len(self.chunks))
+        query_weights = np.bincount(cols, minlength=len(self._vocab)).astype(np.float64)
+
+        if njit is not None:
+            return _bm25_kernel(self._tf_data, self._tf_indices, self._tf_indptr,
+                                self._idf, self._norm, query_weights, BM25_K1)
+
+        # Same formula vectorised over all non-zeros, summed per chunk
+        tf = self._tf_data
+        weights = query_weights[self._tf_indices] * self._idf[self._tf_indices]
+        contrib = weights * tf * (BM25_K1 + 1) / (tf + self._norm[self._tf_rows])
+        return np.bincount(self._tf_rows, weights=contrib, minlength=len(self.chunks))
+
     def search(self, query: str, k: int = 3) -> List[Dict]:
         if not self.chunks: return []
 
         # Same simple tokenization for query
-        query_tokens = "".join([c if c.isalnum() else " " for c in query.lower()]).split()
-        scores = self.bm25.get_scores(query_tokens)
+        query_tokens = tokenize(query)
+        scores = self._score(query_tokens)
         
-        top_n_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+        # Stable sort, so chunks tied on score (also at the k-th place) keep doc order
+        top_n_indices = np.argsort(-scores, kind="stable")[:k]
         
         results = []
         for idx in top_n_indices:
             # LOWER THRESHOLD: Even weak matches should be returned for small docs
             if scores[idx] > 0.0: 
-                chunk = self.chunks[idx].copy()
-                chunk["score"] = scores[idx]
-                del chunk["tokens"]
-                results.append(chunk)
+                results.append({**self.chunks[idx], "score": float(scores[idx])})
         return results
 
 # Simple test
 if __name__ == "__main__":
-    retriever = LocalRetriever()
+    retriever = get_retriever()
     results = retriever.search("return policy for beverages", k=2)
     for r in results:
         print(f"[{r['score']:.2f}] {r['id']}: {r['text'][:50]}...")
\ No newline at end of file
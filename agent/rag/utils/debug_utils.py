@@ -1,22 +1,110 @@
 # debug_utils.py
 import dspy
-from rich.console import Console
+from dspy.utils.callback import BaseCallback
+from rich.console import Console, Group
 from rich.panel import Panel
 from rich.syntax import Syntax
 from rich.table import Table
 from rich.tree import Tree
+from rich.rule import Rule
+from collections import deque
 from datetime import datetime
+from typing import Optional
 import json
+import reprlib
+import threading
 
 console = Console()
 
+# Bounded previews for print_step_summary: stops walking after a few items/levels
+# instead of serializing the whole value and slicing the result
+_preview = reprlib.Repr()
+_preview.maxstring = 200
+_preview.maxother = 200
+_preview.maxlist = _preview.maxtuple = _preview.maxdict = 5
+_preview.maxlevel = 3
+
+def _trunc(text: str, limit: int) -> str:
+    return text if len(text) <= limit else f"{text[:limit]}\n... [truncated]"
+
+# Table layouts, defined once; callers only add rows
+def _make_usage_table() -> Table:
+    table = Table(show_header=False, box=None)
+    table.add_column(style="cyan")
+    table.add_column(style="white")
+    return table
+
+def _make_steps_table() -> Table:
+    table = Table(show_header=True, header_style="bold cyan")
+    table.add_column("#", style="dim", width=4)
+    table.add_column("Step", style="cyan")
+    table.add_column("Timestamp", style="dim")
+    return table
+
+class _LMEventsCallback(BaseCallback):
+    """
+    DSPy callback that logs every LM call (prompt messages, outputs, error) as an lm_call event.
+    Start/end are paired by call_id, so calls from parallel workers don't get mixed up.
+    """
+    def __init__(self, tracker: "DebugTracker"):
+        self.tracker = tracker
+        self._pending = {}
+
+    def on_lm_start(self, call_id, instance, inputs):
+        self._pending[call_id] = {
+            "model": getattr(instance, "model", None),
+            "timestamp": datetime.now().isoformat(),
+            "messages": inputs.get("messages") or inputs.get("prompt"),
+        }
+
+    def on_lm_end(self, call_id, outputs, exception=None):
+        call = self._pending.pop(call_id, {})
+        self.tracker.log_event({"event": "lm_call", **call, "outputs": outputs,
+                                "error": str(exception) if exception else None})
+
 class DebugTracker:
     """
     Enhanced tracker with human-readable logging for DSPy interactions.
+
+    call_history keeps a bounded summary per call (token counts and the first 256 chars of
+    prompt/response), never the LM transcript itself -- dspy's lm.history already holds that.
+    If events_path is set, every inspected call is also appended to that file as one
+    JSON line with the full interaction.
+
+    step_count/call_history are per thread, so parallel batch workers each track
+    (and reset) their own question; events_path is shared.
     """
-    def __init__(self):
-        self.step_count = 0
-        self.call_history = []
+    def __init__(self, events_path: Optional[str] = None, max_history: int = 500):
+        self.max_history = max_history
+        self.events_path = events_path
+        self._local = threading.local()
+        self._events_lock = threading.Lock()
+
+    @property
+    def step_count(self) -> int:
+        return getattr(self._local, "step_count", 0)
+
+    @step_count.setter
+    def step_count(self, value: int):
+        self._local.step_count = value
+
+    @property
+    def call_history(self) -> deque:
+        if not hasattr(self._local, "call_history"):
+            self._local.call_history = deque(maxlen=self.max_history)
+        return self._local.call_history
+
+    def lm_events_callback(self) -> BaseCallback:
+        """Callback for dspy.configure(callbacks=[...]) that streams every LM call to events_path."""
+        return _LMEventsCallback(self)
+
+    def log_event(self, event: dict):
+        """Append one event as a JSON line to events_path (no-op when unset)."""
+        if not self.events_path:
+            return
+        line = json.dumps(event, default=str) + "\n"
+        with self._events_lock, open(self.events_path, "a", encoding="utf-8") as f:
+            f.write(line)
         
     def inspect_last_call(self, step_name: str, show_full: bool = False):
         """
@@ -35,33 +123,29 @@ class DebugTracker:
             last_interaction = history[-1]
             self.step_count += 1
             
-            # Store for summary
-            self.call_history.append({
-                "step": step_name,
-                "timestamp": datetime.now().isoformat(),
-                "interaction": last_interaction
-            })
+            timestamp = datetime.now().isoformat()
+            if self.events_path:
+                self.log_event({"event": "lm_call", "step": step_name, "timestamp": timestamp,
+                                "interaction": last_interaction})
             
-            # Create a panel for the step
-            console.print(f"\n[bold magenta]{'='*60}[/bold magenta]")
-            console.print(f"[bold cyan]🔍 Step {self.step_count}: {step_name}[/bold cyan]")
-            console.print(f"[bold magenta]{'='*60}[/bold magenta]")
+            # Collect every renderable for the step and print them as one Group at the end
+            divider = Rule(style="bold magenta")
+            renderables = [
+                "",
+                divider,
+                f"[bold cyan]🔍 Step {self.step_count}: {step_name}[/bold cyan]",
+                divider,
+            ]
             
             # Extract prompt
             messages = last_interaction.get('messages', [])
+            prompt_content = ""
             if messages:
                 last_msg = messages[-1]
                 prompt_content = last_msg.get('content', '')
                 
-                # Truncate if needed
-                max_len = 500 if not show_full else 5000
-                if len(prompt_content) > max_len:
-                    display_prompt = prompt_content[:max_len] + "\n... [truncated]"
-                else:
-                    display_prompt = prompt_content
-                
-                console.print(Panel(
-                    display_prompt,
+                renderables.append(Panel(
+                    _trunc(prompt_content, 5000 if show_full else 500),
                     title="[bold]📝 Prompt Sent to LM[/bold]",
                     border_style="blue",
                     expand=False
@@ -78,15 +162,8 @@ class DebugTracker:
             else:
                 raw_output = str(response)
             
-            # Truncate response
-            max_resp_len = 800 if not show_full else 8000
-            if len(raw_output) > max_resp_len:
-                display_response = raw_output[:max_resp_len] + "\n... [truncated]"
-            else:
-                display_response = raw_output
-            
-            console.print(Panel(
-                Syntax(display_response, "text", theme="monokai", word_wrap=True),
+            renderables.append(Panel(
+                Syntax(_trunc(raw_output, 8000 if show_full else 800), "text", theme="monokai", word_wrap=True),
                 title="[bold]🤖 Model Response[/bold]",
                 border_style="green",
                 expand=False
@@ -94,18 +171,26 @@ class DebugTracker:
             
             # Show token usage if available
             usage = response.get('usage') if isinstance(response, dict) else None
+            
+            # Store a shallow summary (bounded by max_history)
+            self.call_history.append({
+                "step": step_name,
+                "timestamp": timestamp,
+                "prompt_tokens": (usage or {}).get('prompt_tokens'),
+                "completion_tokens": (usage or {}).get('completion_tokens'),
+                "prompt_head": prompt_content[:256],
+                "response_head": raw_output[:256],
+            })
             if usage:
-                usage_table = Table(show_header=False, box=None)
-                usage_table.add_column(style="cyan")
-                usage_table.add_column(style="white")
-                
+                usage_table = _make_usage_table()
                 usage_table.add_row("Prompt Tokens:", str(usage.get('prompt_tokens', 'N/A')))
                 usage_table.add_row("Completion Tokens:", str(usage.get('completion_tokens', 'N/A')))
                 usage_table.add_row("Total Tokens:", str(usage.get('total_tokens', 'N/A')))
                 
-                console.print(Panel(usage_table, title="📊 Token Usage", border_style="yellow"))
+                renderables.append(Panel(usage_table, title="📊 Token Usage", border_style="yellow"))
             
-            console.print(f"[bold magenta]{'='*60}[/bold magenta]\n")
+            renderables += [divider, ""]
+            console.print(Group(*renderables))
             
         except Exception as e:
             console.print(f"[bold red]❌ Debug print failed: {e}[/bold red]")
@@ -122,7 +207,7 @@ class DebugTracker:
         
         for key, value in data.items():
             if isinstance(value, (list, dict)):
-                tree.add(f"[cyan]{key}:[/cyan] {json.dumps(value, indent=2)[:200]}...")
+                tree.add(f"[cyan]{key}:[/cyan] {_preview.repr(value)[:200]}")
             else:
                 tree.add(f"[cyan]{key}:[/cyan] {value}")
         
@@ -137,22 +222,20 @@ class DebugTracker:
         console.print("[bold yellow]📋 Execution Summary[/bold yellow]")
         console.print(f"[bold magenta]{'='*60}[/bold magenta]")
         
-        summary_table = Table(show_header=True, header_style="bold cyan")
-        summary_table.add_column("#", style="dim", width=4)
-        summary_table.add_column("Step", style="cyan")
-        summary_table.add_column("Timestamp", style="dim")
-        
-        for idx, entry in enumerate(self.call_history, 1):
+        summary_table = _make_steps_table()
+        # call_history only keeps the last max_history calls; number them by overall step
+        first_step = self.step_count - len(self.call_history) + 1
+        for idx, entry in enumerate(self.call_history, first_step):
             timestamp = entry['timestamp'].split('T')[1].split('.')[0]  # HH:MM:SS
             summary_table.add_row(str(idx), entry['step'], timestamp)
         
         console.print(summary_table)
-        console.print(f"[bold green]✅ Total LM Calls: {len(self.call_history)}[/bold green]\n")
+        console.print(f"[bold green]✅ Total LM Calls: {self.step_count}[/bold green]\n")
     
     def reset(self):
         """Reset tracking for new question."""
         self.step_count = 0
-        self.call_history = []
+        self.call_history.clear()
 
 # Global instance
 tracker = DebugTracker()
\ No newline at end of file
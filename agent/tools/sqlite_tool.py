@@ -1,37 +1,91 @@
 import sqlite3
 import re
+import threading
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+
+# MySQL-style YEAR(x)/MONTH(x) -> SQLite strftime, both rewritten in a single scan
+_DATE_FN_RE = re.compile(r"\b(YEAR|MONTH)\(([^)]+)\)", re.IGNORECASE)
+_DATE_FN_FORMAT = {"YEAR": "%Y", "MONTH": "%m"}
+
+def _to_strftime(match: re.Match) -> str:
+    return f"strftime('{_DATE_FN_FORMAT[match.group(1).upper()]}', {match.group(2)})"
+
+# Markdown fences the LM wraps around SQL: an opening ``` / ```sql and a closing ```
+_SQL_FENCE_RE = re.compile(r"^```(?:sql)?\s*|\s*```\s*$", re.MULTILINE | re.IGNORECASE)
+
+def strip_sql_fences(sql: str) -> str:
+    """Remove markdown code fences around generated SQL in a single pass."""
+    return _SQL_FENCE_RE.sub("", sql).strip()
 
 class NorthwindDB:
     def __init__(self, db_path="data/northwind.sqlite"):
         self.db_path = db_path
+        self._conn = None
+        self._conn_lock = threading.Lock()  # the instance is shared by worker threads (get_db)
+        self._schema_cache = None  # schema is static for the life of the DB file
 
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        """
+        One read-only connection per instance, opened on first use and reused by every call.
+        The agent never writes, so mode=ro + query_only also skips write locking.
+        """
+        if self._conn is None:
+            with self._conn_lock:
+                # Re-check under the lock: another thread may have opened it meanwhile
+                if self._conn is None:
+                    conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+                    conn.execute("PRAGMA query_only=1")
+                    conn.execute("PRAGMA mmap_size=268435456")  # 256MB memory-mapped reads
+                    conn.execute("PRAGMA cache_size=-65536")    # 64MB page cache
+                    conn.execute("PRAGMA temp_store=MEMORY")    # sorts/GROUP BY temp tables in RAM
+                    conn.row_factory = sqlite3.Row              # rows convert straight to dicts
+                    self._conn = conn
+        return self._conn
+
+    def close(self):
+        """Close the shared connection; the next call reopens it."""
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
 
     def get_schema(self):
         """
         Returns a compact schema string focusing on the lowercase views 
         to help the LLM avoid quoting hell.
+        Computed on the first call and memoized on the instance.
         """
+        if self._schema_cache is not None:
+            return self._schema_cache
+
         conn = self.get_connection()
-        cursor = conn.cursor()
         
         # We focus on the views we created in the setup
         target_tables = ['orders', 'order_items', 'products', 'customers', 'categories', 'suppliers']
-        schema_str = ""
 
-        for table in target_tables:
-            # Check if table/view exists first
-            try:
-                cursor.execute(f"PRAGMA table_info({table})")
-                columns = cursor.fetchall()
-                if columns:
-                    col_str = ", ".join([f"{col[1]} ({col[2]})" for col in columns])
-                    schema_str += f"Table '{table}': [{col_str}]\n"
-            except:
-                continue
-                
-        conn.close()
+        # All columns of every target in one statement; missing tables/views simply return no rows.
+        # Names are matched case-insensitively, like SQLite resolves them ('orders' -> Orders).
+        placeholders = ", ".join("?" * len(target_tables))
+        try:
+            rows = conn.execute(
+                "SELECT lower(m.name), p.name, p.type FROM sqlite_master m "
+                "JOIN pragma_table_info(m.name) p "
+                f"WHERE m.type IN ('table', 'view') AND lower(m.name) IN ({placeholders}) "
+                "ORDER BY 1, p.cid",
+                target_tables,
+            )
+            columns = {table: [f"{col} ({col_type})" for _, col, col_type in group]
+                       for table, group in groupby(rows, key=itemgetter(0))}
+        except sqlite3.Error:
+            columns = {}
+
+        schema_str = "".join(
+            f"Table '{table}': [{', '.join(columns[table])}]\n"
+            for table in target_tables if table in columns
+        )
+        self._schema_cache = schema_str
         return schema_str
 
     def execute_query(self, query: str):
@@ -41,26 +95,32 @@ class NorthwindDB:
             
         # 2. Hard-Fix Common Hallucinations (Safety Net)
         # Phi-3.5 loves YEAR() but SQLite hates it.
-        if "YEAR(" in query:
-            query = re.sub(r"YEAR\(([^)]+)\)", r"strftime('%Y', \1)", query)
-        if "MONTH(" in query:
-            query = re.sub(r"MONTH\(([^)]+)\)", r"strftime('%m', \1)", query)
+        query = _DATE_FN_RE.sub(_to_strftime, query)
             
         conn = self.get_connection()
         cursor = conn.cursor()
         try:
             cursor.execute(query)
-            # Get column names
-            headers = [description[0] for description in cursor.description] if cursor.description else []
-            rows = cursor.fetchall()
-            conn.close()
-            
             # Return list of dicts for easier processing
-            results = []
-            for row in rows:
-                results.append(dict(zip(headers, row)))
-            return results
+            return [dict(row) for row in cursor]
             
         except sqlite3.Error as e:
-            conn.close()
-            return f"SQL Error: {str(e)}"
\ No newline at end of file
+            return f"SQL Error: {str(e)}"
+
+    def has_rows(self, query: str) -> bool:
+        """
+        True if the query runs and returns at least one row.
+        Only the first row is fetched, however large the result would be.
+        """
+        if not query or not query.strip():
+            return False
+        query = _DATE_FN_RE.sub(_to_strftime, query)
+        try:
+            return self.get_connection().execute(query).fetchone() is not None
+        except sqlite3.Error:
+            return False
+
+@lru_cache(maxsize=None)
+def get_db(db_path: str = "data/northwind.sqlite") -> NorthwindDB:
+    """Process-wide NorthwindDB per db_path, so every caller shares one connection and schema."""
+    return NorthwindDB(db_path)
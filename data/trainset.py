@@ -1,6 +1,6 @@
 
 import dspy
-trainset = [
+trainset = (
     # ==========================================
     # Example 1: RAG — Beverages return days
     # ==========================================
@@ -177,4 +177,8 @@ LIMIT 1;
         sql_query=""
     ).with_inputs("question", "schema_context", "context"),
     
-]
+)
+
+# Constant, so a tuple; the triple-quoted SQL is stripped once here instead of by every consumer
+for example in trainset:
+    example.sql_query = example.sql_query.strip()
@@ -2,14 +2,30 @@
 import json
 import click
 import dspy
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeElapsedColumn
 from rich.panel import Panel
 from rich.table import Table
 from agent.graph_hybrid import build_graph
 from agent.rag.utils.debug_utils import tracker
+from agent.lm_config import init_dspy, warm_up
 
-console = Console()
+# No auto-highlighting: every print would otherwise run Rich's regex highlighter over the text
+console = Console(log_time=False, highlight=False)
+
+# Table layouts, defined once; callers only add rows
+def _make_metrics_table(title: str) -> Table:
+    table = Table(title=title, show_header=True)
+    table.add_column("Metric", style="cyan")
+    table.add_column("Value", style="white")
+    return table
+
+def _make_result_table() -> Table:
+    table = Table(show_header=False, box=None, padding=(0, 2))
+    table.add_column(style="bold cyan", width=15)
+    table.add_column(style="white")
+    return table
 
 def run_zero_shot_experiment(questions, module_name="sql_gen"):
     """
@@ -25,7 +41,7 @@ def run_zero_shot_experiment(questions, module_name="sql_gen"):
     console.print(f"\n[bold yellow]🧪 Running Zero-Shot Experiment: {module_name}[/bold yellow]\n")
     
     from agent.dspy_signatures import TextToSQL, RouterSignature, GenerateAnswer
-    from agent.tools.sqlite_tool import NorthwindDB
+    from agent.tools.sqlite_tool import get_db, strip_sql_fences
     
     results = {
         "total": len(questions),
@@ -34,9 +50,12 @@ def run_zero_shot_experiment(questions, module_name="sql_gen"):
         "avg_confidence": 0.0
     }
     
+    # Predictions by question text, so a question repeated in the batch is only sent to the LM once
+    _seen = {}
+    
     if module_name == "sql_gen":
         predictor = dspy.Predict(TextToSQL)
-        db = NorthwindDB()
+        db = get_db()  # same connection/schema the graph uses afterwards
         schema = db.get_schema()
         
         console.print("[cyan]Testing SQL Generation (zero-shot)...[/cyan]")
@@ -46,14 +65,16 @@ def run_zero_shot_experiment(questions, module_name="sql_gen"):
             console.print(f"\n[dim]Q: {question[:80]}...[/dim]")
             
             try:
-                result = predictor(
-                    question=question,
-                    schema_context=schema,
-                    context=""
-                )
+                if question not in _seen:
+                    _seen[question] = predictor(
+                        question=question,
+                        schema_context=schema,
+                        context=""
+                    )
+                result = _seen[question]
                 
                 if hasattr(result, 'sql_query') and result.sql_query:
-                    sql = result.sql_query.replace("```sql", "").replace("```", "").strip()
+                    sql = strip_sql_fences(result.sql_query)
                     
                     # Test execution
                     exec_result = db.execute_query(sql)
@@ -91,7 +112,9 @@ def run_zero_shot_experiment(questions, module_name="sql_gen"):
             console.print(f"\n[dim]Q: {question[:80]}...[/dim]")
             
             try:
-                result = predictor(question=question)
+                if question not in _seen:
+                    _seen[question] = predictor(question=question)
+                result = _seen[question]
                 
                 if hasattr(result, 'classification'):
                     cls = result.classification.lower()
@@ -114,10 +137,7 @@ def run_zero_shot_experiment(questions, module_name="sql_gen"):
     # Print summary
     success_rate = (results["success"] / results["total"]) * 100
     
-    summary_table = Table(title="Zero-Shot Results", show_header=True)
-    summary_table.add_column("Metric", style="cyan")
-    summary_table.add_column("Value", style="white")
-    
+    summary_table = _make_metrics_table("Zero-Shot Results")
     summary_table.add_row("Total Questions", str(results["total"]))
     summary_table.add_row("Successful", str(results["success"]))
     summary_table.add_row("Failed", str(len(results["failures"])))
@@ -126,15 +146,105 @@ def run_zero_shot_experiment(questions, module_name="sql_gen"):
     console.print("\n")
     console.print(summary_table)
     
+    tracker.log_event({"event": "experiment", "module": module_name, **results})
     return results
 
+def iter_questions(path: str):
+    """Yield question dicts from a JSONL file one line at a time (blank lines skipped)."""
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def count_questions(path: str) -> int:
+    """Number of questions in a JSONL file (non-blank lines), without parsing them."""
+    with open(path, 'r') as f:
+        return sum(1 for line in f if line.strip())
+
+def run_question(app, item: dict, position: int, total: int, verbose: bool) -> dict:
+    """Run one question through the graph, print its result and return the output record."""
+    q_id = item['id']
+    question = item['question']
+    fmt = item['format_hint']
+    
+    # Reset tracker for each question (per thread, so parallel workers don't collide)
+    tracker.reset()
+    
+    if verbose:
+        console.print(f"\n[bold blue]{'='*70}[/bold blue]")
+        console.print(f"[bold white]Question {position}/{total}[/bold white]")
+        console.print(f"[bold blue]{'='*70}[/bold blue]")
+        console.print(f"[cyan]ID:[/cyan] {q_id}")
+        console.print(f"[cyan]Q:[/cyan] {question}")
+        console.print(f"[dim]Expected format: {fmt}[/dim]\n")
+    
+    # Initial State
+    initial_state = {
+        "question": question,
+        "format_hint": fmt,
+        "retry_count": 0,
+        "citations": []
+    }
+    
+    # Run Graph
+    try:
+        final_state = app.invoke(initial_state)
+        
+        output = {
+            "id": q_id,
+            "final_answer": final_state.get("final_answer"),
+            "sql": final_state.get("sql_query", ""),
+            "confidence": 1.0 if not final_state.get("error") else 0.5,
+            "explanation": final_state.get("explanation", ""),
+            "citations": final_state.get("citations", [])
+        }
+        
+        # Display results only if verbose; by default the progress bar shows the current q_id
+        if not verbose:
+            return output
+        
+        result_table = _make_result_table()
+        
+        if final_state.get("classification"):
+            result_table.add_row("Route:", final_state["classification"])
+        
+        if final_state.get("sql_query"):
+            sql_preview = final_state['sql_query'][:100] + "..." if len(final_state['sql_query']) > 100 else final_state['sql_query']
+            result_table.add_row("SQL:", sql_preview)
+        
+        result_table.add_row("Answer:", str(output['final_answer']))
+        result_table.add_row("Citations:", ", ".join(output['citations'][:5]))
+        result_table.add_row("Confidence:", f"{output['confidence']:.2f}")
+        
+        console.print(Panel(result_table, title="[bold green]✅ Result[/bold green]", border_style="green"))
+        tracker.print_final_summary()
+        
+        return output
+        
+    except Exception as e:
+        console.print(Panel(
+            f"[bold red]Error: {str(e)}[/bold red]",
+            title="❌ Processing Failed",
+            border_style="red"
+        ))
+        return {
+            "id": q_id,
+            "final_answer": None,
+            "sql": "",
+            "confidence": 0.0,
+            "explanation": f"System Error: {str(e)}",
+            "citations": []
+        }
+
 @click.command()
 @click.option('--batch', required=True, help='Input JSONL file')
 @click.option('--out', required=True, help='Output JSONL file')
 @click.option('--verbose', '-v', is_flag=True, help='Show detailed DSPy interactions')
 @click.option('--experiment', type=click.Choice(['sql_gen', 'router', 'none']), 
               default='none', help='Run zero-shot experiment before main run')
-def main(batch, out, verbose, experiment):
+@click.option('--events', default=None, help='Append every LM call (and experiment results) to this JSONL file')
+@click.option('--workers', default=1, show_default=True, help='Questions processed concurrently')
+def main(batch, out, verbose, experiment, events, workers):
     """
     Retail Analytics Copilot - Main Entry Point
     
@@ -145,6 +255,8 @@ def main(batch, out, verbose, experiment):
         --verbose / -v : Show detailed DSPy prompts and responses
         --experiment sql_gen : Run zero-shot SQL generation experiment first
         --experiment router : Run zero-shot router experiment first
+        --events events.jsonl : Stream LM calls and experiment results as JSON lines
+        --workers 4 : Process 4 questions concurrently
     """
     
     # Print banner
@@ -154,41 +266,45 @@ def main(batch, out, verbose, experiment):
         border_style="cyan"
     ))
     
+    tracker.events_path = events
+    
     # 1. Setup DSPy (Ollama)
     console.print("\n[yellow]⚙️  Configuring DSPy with Ollama...[/yellow]")
-    lm = dspy.LM(
-        model="ollama_chat/phi3.5:3.8b-mini-instruct-q3_K_M",
-        api_base="http://localhost:11434",
-        num_ctx=8192,      
-        max_tokens=4096,     
-        temperature=0.0     
-    )
-    dspy.configure(lm=lm)
+    lm = init_dspy(max_tokens=4096, num_ctx=8192)
+    if events:
+        dspy.configure(callbacks=[tracker.lm_events_callback()])
     console.print("[green]✓ DSPy configured[/green]")
+    if warm_up(lm):
+        console.print("[green]✓ LM warmed[/green]")
+    else:
+        console.print("[yellow]⚠ LM warm-up failed (is Ollama running?)[/yellow]")
     
-    # 2. Load questions
-    console.print(f"\n[yellow]📂 Loading questions from {batch}...[/yellow]")
-    with open(batch, 'r') as f:
-        questions = [json.loads(line) for line in f]
-    console.print(f"[green]✓ Loaded {len(questions)} questions[/green]")
+    # 2. Count questions (they are streamed from the file, not loaded up front)
+    console.print(f"\n[yellow]📂 Reading questions from {batch}...[/yellow]")
+    total = count_questions(batch)
+    console.print(f"[green]✓ Found {total} questions[/green]")
     
     # 3. Optional: Run experiment
     if experiment != 'none':
-        run_zero_shot_experiment(questions, module_name=experiment)
-        console.print("\n[bold yellow]Press Enter to continue with main processing...[/bold yellow]")
-        input()
+        run_zero_shot_experiment(list(iter_questions(batch)), module_name=experiment)
+        # Parallel runs are meant to be unattended -- don't block on a keypress
+        if workers <= 1:
+            console.print("\n[bold yellow]Press Enter to continue with main processing...[/bold yellow]")
+            input()
     
     # 4. Build Graph
     console.print("\n[yellow]🔧 Building LangGraph workflow...[/yellow]")
     app = build_graph()
     console.print("[green]✓ Graph compiled[/green]")
     
-    results = []
+    processed = 0
     
-    # 5. Process Batch with Progress Bar
-    console.print(f"\n[bold green]🚀 Starting batch processing...[/bold green]\n")
+    # 5. Process Batch with Progress Bar; each result is written (and flushed) as soon as it
+    # is ready, so a crash mid-batch keeps everything finished so far
+    console.print(f"\n[bold green]🚀 Starting batch processing...[/bold green]")
+    console.print(f"[yellow]💾 Writing results to {out}[/yellow]\n")
     
-    with Progress(
+    with open(out, 'w', encoding='utf-8', buffering=1 << 20) as out_file, Progress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
         BarColumn(),
@@ -197,95 +313,54 @@ def main(batch, out, verbose, experiment):
         console=console
     ) as progress:
         
-        task = progress.add_task("[cyan]Processing questions...", total=len(questions))
+        task = progress.add_task("[cyan]Processing questions...", total=total)
         
-        for i, item in enumerate(questions):
-            q_id = item['id']
-            question = item['question']
-            fmt = item['format_hint']
-            
-            # Reset tracker for each question
-            tracker.reset()
-            
-            console.print(f"\n[bold blue]{'='*70}[/bold blue]")
-            console.print(f"[bold white]Question {i+1}/{len(questions)}[/bold white]")
-            console.print(f"[bold blue]{'='*70}[/bold blue]")
-            console.print(f"[cyan]ID:[/cyan] {q_id}")
-            console.print(f"[cyan]Q:[/cyan] {question}")
-            console.print(f"[dim]Expected format: {fmt}[/dim]\n")
-            
-            # Initial State
-            initial_state = {
-                "question": question,
-                "format_hint": fmt,
-                "retry_count": 0,
-                "citations": []
-            }
+        def write_result(res: dict):
+            # Serialize straight into the 1MB buffer; flush hands the whole record to the OS in one write
+            json.dump(res, out_file, ensure_ascii=False, separators=(",", ":"))
+            out_file.write("\n")
+            out_file.flush()
+        
+        if workers <= 1:
+            for i, item in enumerate(iter_questions(batch)):
+                progress.update(task, description=f"[cyan]{item['id']}")
+                write_result(run_question(app, item, i + 1, total, verbose))
+                processed += 1
+                progress.update(task, advance=1)
+        else:
+            # Each question is I/O-bound on Ollama, so overlap them. Results are written in
+            # input order: finished ones wait in `ready` until every earlier one is written.
+            # At most 2*workers questions are in flight or waiting, so memory stays constant
+            # however large the batch is.
+            window = 2 * workers
+            questions = enumerate(iter_questions(batch))
+            pending, ready = {}, {}
             
-            # Run Graph
-            try:
-                final_state = app.invoke(initial_state)
-                
-                output = {
-                    "id": q_id,
-                    "final_answer": final_state.get("final_answer"),
-                    "sql": final_state.get("sql_query", ""),
-                    "confidence": 1.0 if not final_state.get("error") else 0.5,
-                    "explanation": final_state.get("explanation", ""),
-                    "citations": final_state.get("citations", [])
-                }
-                
-                # Display results
-                result_table = Table(show_header=False, box=None, padding=(0, 2))
-                result_table.add_column(style="bold cyan", width=15)
-                result_table.add_column(style="white")
-                
-                if final_state.get("classification"):
-                    result_table.add_row("Route:", final_state["classification"])
-                
-                if final_state.get("sql_query"):
-                    sql_preview = final_state['sql_query'][:100] + "..." if len(final_state['sql_query']) > 100 else final_state['sql_query']
-                    result_table.add_row("SQL:", sql_preview)
-                
-                result_table.add_row("Answer:", str(output['final_answer']))
-                result_table.add_row("Citations:", ", ".join(output['citations'][:5]))
-                result_table.add_row("Confidence:", f"{output['confidence']:.2f}")
-                
-                console.print(Panel(result_table, title="[bold green]✅ Result[/bold green]", border_style="green"))
-                
-                # Show full summary if verbose
-                if verbose:
-                    tracker.print_final_summary()
-                
-                results.append(output)
-                
-            except Exception as e:
-                console.print(Panel(
-                    f"[bold red]Error: {str(e)}[/bold red]",
-                    title="❌ Processing Failed",
-                    border_style="red"
-                ))
-                results.append({
-                    "id": q_id,
-                    "final_answer": None,
-                    "sql": "",
-                    "confidence": 0.0,
-                    "explanation": f"System Error: {str(e)}",
-                    "citations": []
-                })
+            def fill_window():
+                while len(pending) + len(ready) < window:
+                    next_question = next(questions, None)
+                    if next_question is None:
+                        return
+                    i, item = next_question
+                    pending[pool.submit(run_question, app, item, i + 1, total, verbose)] = i
             
-            progress.update(task, advance=1)
-
-    # 6. Save Outputs
-    console.print(f"\n[yellow]💾 Saving results to {out}...[/yellow]")
-    with open(out, 'w') as f:
-        for res in results:
-            f.write(json.dumps(res) + "\n")
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                fill_window()
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i = pending.pop(future)
+                        ready[i] = future.result()
+                        progress.update(task, advance=1, description=f"[cyan]{ready[i]['id']}")
+                    while processed in ready:
+                        write_result(ready.pop(processed))
+                        processed += 1
+                    fill_window()
     
-    # 7. Final Summary
+    # 6. Final Summary
     console.print(Panel.fit(
         f"[bold green]✅ Processing Complete![/bold green]\n\n"
-        f"Questions Processed: {len(results)}\n"
+        f"Questions Processed: {processed}\n"
         f"Output File: {out}\n",
         border_style="green"
     ))
@@ -1,11 +1,11 @@
 import sqlite3
-import pandas as pd
 
 # ===============================
 # 1. Connect to Northwind SQLite DB
 # ===============================
 db_path = "data/northwind.sqlite"
-conn = sqlite3.connect(db_path)
+# Read-only: a missing/mistyped path errors out instead of silently creating an empty DB
+conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
 
 # ===============================
 # 2. Get all tables and views
@@ -16,23 +16,24 @@ FROM sqlite_master
 WHERE type IN ('table', 'view')
 ORDER BY type, name;
 """
-tables_and_views = pd.read_sql(tables_query, conn)
+tables_and_views = conn.execute(tables_query).fetchall()
 
 print("Tables and Views found:")
-print(tables_and_views)
+for name, ttype in tables_and_views:
+    print(f"  {ttype:<5}  {name}")
 
 # ===============================
 # 3. Inspect sample rows for each
 # ===============================
 sample_size = 5  # number of rows per table/view
 
-for idx, row in tables_and_views.iterrows():
-    name = row['name']
-    ttype = row['type']
+for name, ttype in tables_and_views:
     print(f"\n===== {ttype.upper()}: {name} =====")
     try:
-        sample_df = pd.read_sql(f"SELECT * FROM '{name}' LIMIT {sample_size}", conn)
-        print(sample_df)
+        cursor = conn.execute(f'SELECT * FROM "{name}" LIMIT {sample_size}')
+        print(" | ".join(col[0] for col in cursor.description))
+        for sample_row in cursor:
+            print(" | ".join(str(value) for value in sample_row))
     except Exception as e:
         print(f"Error reading {name}: {e}")
 
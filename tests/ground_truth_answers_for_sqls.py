@@ -1,3 +1,4 @@
+import json
 import sqlite3
 
 # ==========================
@@ -14,79 +15,81 @@ def connect_db(db_path=DB_PATH):
     return conn
 
 def execute_sql(conn, query, params=None):
-    params = params or {}
-    cur = conn.cursor()
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    return [dict(row) for row in rows]
+    # conn.execute hands back the cursor; rows are turned into dicts as they stream out of it
+    return [dict(row) for row in conn.execute(query, params or {})]
 
 # ==========================
-# SQL QUERIES
+# SQL QUERY
 # ==========================
 
-# 1. Top 3 products by revenue all-time
-SQL_TOP3_PRODUCTS = """
-SELECT 
-    p.ProductName AS product,
-    ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) AS revenue
-FROM "Order Details" od
-JOIN Products p ON p.ProductID = od.ProductID
-GROUP BY p.ProductID
-ORDER BY revenue DESC
-LIMIT 3;
-"""
-
-# 2. Total revenue for Beverages during Summer Beverages 2016
-SQL_REVENUE_BEVERAGES_SUMMER_2016 = """
-SELECT 
-    ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) AS revenue
-FROM "Order Details" od
-JOIN Orders o ON o.OrderID = od.OrderID
-JOIN Products p ON p.ProductID = od.ProductID
-JOIN Categories c ON c.CategoryID = p.CategoryID
-WHERE c.CategoryName = 'Beverages'
-  AND o.OrderDate BETWEEN '2016-07-01' AND '2016-07-31';
-"""
-
-# 3. Top customer by gross margin in 2016
-SQL_TOP_CUSTOMER_MARGIN_2016 = """
-SELECT 
-    c.CompanyName AS customer,
-    ROUND(SUM((od.UnitPrice - od.UnitPrice*0.7) * od.Quantity * (1 - od.Discount)), 2) AS margin
-FROM "Order Details" od
-JOIN Orders o ON o.OrderID = od.OrderID
-JOIN Customers c ON c.CustomerID = o.CustomerID
-WHERE o.OrderDate BETWEEN '2016-01-01' AND '2016-12-31'
-GROUP BY c.CustomerID
-ORDER BY margin DESC
-LIMIT 1;
-"""
-
-# 4. AOV Winter Classics 2016
-SQL_AOV_WINTER_2016 = """
-SELECT 
+# All five ground-truth answers in one statement: the order lines are joined once
+# (materialized CTE) and every answer is aggregated from that result.
+# Orders/Products/Categories are LEFT JOINed so no line is dropped for a metric that doesn't
+# need them; each answer filters on exactly the joins its standalone query required.
+# Lists and (name, value) pairs come back as JSON; scalars as plain columns.
+SQL_GROUND_TRUTH = """
+WITH lines AS MATERIALIZED (
+    SELECT
+        od.OrderID,
+        o.OrderDate,
+        o.CustomerID,
+        p.ProductID,
+        p.ProductName,
+        c.CategoryID,
+        c.CategoryName,
+        od.Quantity,
+        od.UnitPrice * od.Quantity * (1 - od.Discount) AS revenue,
+        (od.UnitPrice - od.UnitPrice*0.7) * od.Quantity * (1 - od.Discount) AS margin
+    FROM "Order Details" od
+    LEFT JOIN Orders o ON o.OrderID = od.OrderID
+    LEFT JOIN Products p ON p.ProductID = od.ProductID
+    LEFT JOIN Categories c ON c.CategoryID = p.CategoryID
+)
+SELECT
+    -- 1. Top 3 products by revenue all-time
+    (SELECT json_group_array(json_object('product', product, 'revenue', revenue)) FROM (
+        SELECT ProductName AS product, ROUND(SUM(revenue), 2) AS revenue
+        FROM lines
+        WHERE ProductID IS NOT NULL
+        GROUP BY ProductID
+        ORDER BY revenue DESC
+        LIMIT 3
+    )) AS top3_products,
+
+    -- 2. Total revenue for Beverages during Summer Beverages 2016
+    ROUND(SUM(CASE WHEN CategoryName = 'Beverages'
+                    AND OrderDate BETWEEN '2016-07-01' AND '2016-07-31'
+                   THEN revenue END), 2) AS revenue_beverages_summer_2016,
+
+    -- 3. Top customer by gross margin in 2016
+    (SELECT json_object('customer', customer, 'margin', margin) FROM (
+        SELECT cu.CompanyName AS customer, ROUND(SUM(l.margin), 2) AS margin
+        FROM lines l
+        JOIN Customers cu ON cu.CustomerID = l.CustomerID
+        WHERE l.OrderDate BETWEEN '2016-01-01' AND '2016-12-31'
+        GROUP BY cu.CustomerID
+        ORDER BY margin DESC
+        LIMIT 1
+    )) AS top_customer_margin_2016,
+
+    -- 4. AOV Winter Classics 2016
     ROUND(
-        SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) * 1.0 / COUNT(DISTINCT o.OrderID),
+        SUM(CASE WHEN OrderDate BETWEEN '2016-12-01' AND '2016-12-31' THEN revenue END) * 1.0
+        / COUNT(DISTINCT CASE WHEN OrderDate BETWEEN '2016-12-01' AND '2016-12-31' THEN OrderID END),
         2
-    ) AS aov
-FROM "Order Details" od
-JOIN Orders o ON o.OrderID = od.OrderID
-WHERE o.OrderDate BETWEEN '2016-12-01' AND '2016-12-31';
-"""
-
-# 5. Top category by quantity during Summer Beverages 2016
-SQL_TOP_CATEGORY_QTY_SUMMER_2016 = """
-SELECT 
-    c.CategoryName AS category,
-    SUM(od.Quantity) AS quantity
-FROM "Order Details" od
-JOIN Orders o ON o.OrderID = od.OrderID
-JOIN Products p ON p.ProductID = od.ProductID
-JOIN Categories c ON c.CategoryID = p.CategoryID
-WHERE o.OrderDate BETWEEN '2016-07-01' AND '2016-07-31'
-GROUP BY c.CategoryID
-ORDER BY quantity DESC
-LIMIT 1;
+    ) AS aov_winter_2016,
+
+    -- 5. Top category by quantity during Summer Beverages 2016
+    (SELECT json_object('category', category, 'quantity', quantity) FROM (
+        SELECT CategoryName AS category, SUM(Quantity) AS quantity
+        FROM lines
+        WHERE OrderDate BETWEEN '2016-07-01' AND '2016-07-31'
+          AND CategoryID IS NOT NULL
+        GROUP BY CategoryID
+        ORDER BY quantity DESC
+        LIMIT 1
+    )) AS top_category_qty_summer_2016
+FROM lines;
 """
 
 # ==========================
@@ -94,30 +97,25 @@ LIMIT 1;
 # ==========================
 if __name__ == "__main__":
     conn = connect_db()
+    answers = execute_sql(conn, SQL_GROUND_TRUTH)[0]
+    conn.close()
 
     # --- Top 3 Products ---
-    results = execute_sql(conn, SQL_TOP3_PRODUCTS)
     print("=== Top 3 Products by Revenue (All-Time) ===")
-    print({"final_answer": results})
+    print({"final_answer": json.loads(answers['top3_products'])})
 
     # --- Revenue Beverages Summer 2016 ---
-    results = execute_sql(conn, SQL_REVENUE_BEVERAGES_SUMMER_2016)
     print("\n=== Revenue Beverages Summer 2016 ===")
-    print({"final_answer": results[0]['revenue']})
+    print({"final_answer": answers['revenue_beverages_summer_2016']})
 
     # --- Top Customer by Gross Margin 2016 ---
-    results = execute_sql(conn, SQL_TOP_CUSTOMER_MARGIN_2016)
     print("\n=== Top Customer by Gross Margin 2016 ===")
-    print({"final_answer": {"customer": results[0]['customer'], "margin": results[0]['margin']}})
+    print({"final_answer": json.loads(answers['top_customer_margin_2016'])})
 
     # --- AOV Winter 2016 ---
-    results = execute_sql(conn, SQL_AOV_WINTER_2016)
     print("\n=== AOV Winter Classics 2016 ===")
-    print({"final_answer": results[0]['aov']})
+    print({"final_answer": answers['aov_winter_2016']})
 
     # --- Top Category Qty Summer 2016 ---
-    results = execute_sql(conn, SQL_TOP_CATEGORY_QTY_SUMMER_2016)
     print("\n=== Top Category by Quantity Summer Beverages 2016 ===")
-    print({"final_answer": {"category": results[0]['category'], "quantity": results[0]['quantity']}})
-
-    conn.close()
+    print({"final_answer": json.loads(answers['top_category_qty_summer_2016'])})
@@ -1,11 +1,10 @@
 import dspy
 from agent.dspy_signatures import RouterSignature
+from agent.lm_config import init_dspy
 
 # Connect to Ollama (Phi-3.5)
 
-lm = dspy.LM("ollama_chat/phi3.5:3.8b-mini-instruct-q3_K_M", api_base="http://localhost:11434", api_key="")
-
-dspy.configure(lm=lm)
+lm = init_dspy()
 
 # Test the Router
 router = dspy.ChainOfThought(RouterSignature)
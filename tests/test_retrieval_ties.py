@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+import numpy as np
+
+from agent.rag.retrieval import LocalRetriever
+
+# Scores with a 5-way tie straddling the k=3 boundary (chunks 1, 2, 4, 6, 8)
+TIED_SCORES = np.array([0.5, 0.789465, 0.789465, 0.9, 0.789465, 0.2, 0.789465, 0.1, 0.789465, 0.95])
+
+def _ranked_chunks(retriever: LocalRetriever, k: int):
+    """Positions (in doc order) of the chunks search() returns, best first."""
+    ids = [chunk["id"] for chunk in retriever.chunks]
+    return [ids.index(r["id"]) for r in retriever.search("anything", k=k)]
+
+def test_tie_at_k_boundary_keeps_doc_order():
+    with tempfile.TemporaryDirectory() as docs_dir:
+        with open(os.path.join(docs_dir, "ties.md"), "w", encoding="utf-8") as f:
+            f.write("".join(f"## Section {i}\n- filler text {i}\n" for i in range(len(TIED_SCORES))))
+        retriever = LocalRetriever(docs_dir)
+
+    # Pin the scores so only the top-k selection is under test
+    retriever._score = lambda query_tokens: TIED_SCORES
+
+    # Highest two, then the earliest of the tied chunks
+    assert _ranked_chunks(retriever, 3) == [9, 3, 1]
+    assert _ranked_chunks(retriever, 5) == [9, 3, 1, 2, 4]
+
+if __name__ == "__main__":
+    test_tie_at_k_boundary_keeps_doc_order()
+    print("✅ Ties at the k-th place keep doc order")
@@ -0,0 +1,39 @@
+import json
+
+from agent.graph_hybrid import _route_heuristic
+from data.trainset import trainset
+
+# Labeled route of every trainset question (see the comments in data/trainset.py)
+TRAINSET_ROUTES = {
+    "How many days can I return unopened Beverages?": "rag_only",
+    "Which product category had the highest quantity sold during Summer 1997?": "hybrid",
+    "What was the average order value in Winter 1997?": "hybrid",
+    "Which are the top 3 products by total revenue of all time?": "sql_only",
+    "What was the total revenue for Beverages during Summer 1997?": "hybrid",
+    "Which customer had the highest gross margin in 1997?": "hybrid",
+    "What is the return period for perishable products like Produce and Seafood?": "rag_only",
+    "Which category generated the most sales in 1997?": "hybrid",
+    "How is Average Order Value (AOV) calculated?": "rag_only",
+    "How is Gross Margin calculated?": "rag_only",
+}
+
+# Sample eval ids are prefixed with their route
+SAMPLE_ROUTES = {"rag": "rag_only", "hybrid": "hybrid", "sql": "sql_only"}
+
+def test_trainset_routes():
+    for example in trainset:
+        expected = TRAINSET_ROUTES[example.question]
+        assert _route_heuristic(example.question) == expected, example.question
+
+def test_sample_question_routes():
+    with open("sample_questions_hybrid_eval.jsonl") as f:
+        for line in f:
+            if not line.strip(): continue
+            item = json.loads(line)
+            expected = SAMPLE_ROUTES[item["id"].split("_")[0]]
+            assert _route_heuristic(item["question"]) == expected, item["id"]
+
+if __name__ == "__main__":
+    test_trainset_routes()
+    test_sample_question_routes()
+    print("✅ Router heuristic matches every labeled route")
@@ -1,22 +1,18 @@
 import sqlite3
+from contextlib import closing
 
 DB_PATH = "data/northwind.sqlite"
 
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
+# Read-only: just listing views, nothing to lock or write
+with closing(sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)) as conn:
+    views = conn.execute("""
+        SELECT name
+        FROM sqlite_master
+        WHERE type='view';
+    """).fetchall()
 
 print("All views found:")
-cursor.execute("""
-    SELECT name 
-    FROM sqlite_master 
-    WHERE type='view';
-""")
-views = cursor.fetchall()
-
 if not views:
     print("No views found in this DB at all.")
 else:
-    for v in views:
-        print("-", v[0])
-
-conn.close()
+    print("\n".join(f"- {v[0]}" for v in views))